@@ -4,12 +4,21 @@ Build script for Book Location Map
 Reads books.yaml, geocodes locations, and generates static HTML map
 """
 
+import argparse
+import functools
+import gzip
+import hashlib
+import io
+import logging
+import math
+import random
 import yaml
-import json
+import orjson
 import os
-import time
 import sys
-import re
+import time
+from collections import Counter
+from html import escape
 from pathlib import Path
 
 # Try to import API key from config file
@@ -17,23 +26,126 @@ try:
     from config import STADIA_API_KEY
 except ImportError:
     STADIA_API_KEY = os.getenv('STADIA_API_KEY', '')
-from geopy.geocoders import Nominatim
-from geopy.exc import GeocoderTimedOut, GeocoderServiceError
+
+# Optional self-hosted Nominatim instance, as a host (HTTPS) or a full URL
+# (e.g. "http://localhost:8080")
+try:
+    from config import NOMINATIM_DOMAIN
+except ImportError:
+    NOMINATIM_DOMAIN = os.getenv('NOMINATIM_DOMAIN', '')
+# Use the libyaml-backed loader when PyYAML was built with it
+try:
+    from yaml import CSafeLoader as YAMLLoader
+except ImportError:
+    from yaml import SafeLoader as YAMLLoader
+
+# Brotli is optional; without it only .gz copies are written
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Minifiers are optional; without them --minify leaves the code as-is
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+try:
+    import rcssmin
+except ImportError:
+    rcssmin = None
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+# Per-location progress and warnings; summary output stays on print()
+log = logging.getLogger('bookmap')
 
 # Configuration
 INPUT_FILE = "books.yaml"
 OUTPUT_DIR = "output"
-CACHE_FILE = "cache/geocoding.json"
+CACHE_FILE = "cache/geocoding.ndjson"
+LEGACY_CACHE_FILE = "cache/geocoding.json"
+PARSE_CACHE_FILE = "cache/books.parsed.json"
 TEMPLATE_FILE = "templates/map.html"
+STYLE_TEMPLATE_FILE = "templates/map.css"
+MAP_JS_TEMPLATE_FILE = "templates/map.js"
 CSS_FILE = "static/css/map.css"
+BUILD_STAMP_FILE = "output/.build-stamp"
+
+# Compiled templates are cached by the environment
+TEMPLATE_ENV = Environment(
+    loader=FileSystemLoader(Path(TEMPLATE_FILE).parent),
+    autoescape=select_autoescape(['html'])
+)
 
 # Geocoding rate limit (Nominatim requires max 1 request per second)
 GEOCODE_DELAY = 1.1  # Slightly more than 1 second to be safe
 
+# How long to remember locations that couldn't be geocoded before retrying
+NEGATIVE_CACHE_TTL = 30 * 86400  # Nominatim found no match
+ERROR_CACHE_TTL = 3600  # Nominatim timed out or returned an error
+
+# Cover and review links must be absolute
+URL_PREFIXES = ('http://', 'https://')
+
+# Optional book fields: (field, allowed types, description, must be a URL)
+OPTIONAL_FIELD_CHECKS = (
+    ('author', str, 'a string', False),
+    ('cover', str, 'a string', True),
+    ('review', str, 'a string', True),
+    ('year', (int, str), 'a number or string', False),
+    ('genre', str, 'a string', False),
+)
+
+# Map tile and pin styles offered by the preview style chooser
+MAP_STYLES = [
+    ('positron', 'Positron'),
+    ('voyager', 'Voyager'),
+    ('dark', 'Dark'),
+    ('osm', 'OSM'),
+    ('humanitarian', 'HOT'),
+    ('terrain', 'Terrain'),
+    ('toner', 'Toner'),
+    ('watercolor', 'Watercolor'),
+    ('alidade_smooth', 'Alidade'),
+    ('alidade_smooth_dark', 'Alidade Dark'),
+    ('osm_bright', 'OSM Bright'),
+    ('outdoors', 'Outdoors'),
+    ('opentopomap', 'TopoMap'),
+    ('cyclosm', 'CyclOSM'),
+    ('esri_world', 'Satellite'),
+    ('wikimedia', 'Wikimedia'),
+    ('toner_lite', 'Toner Lite'),
+    ('voyager_nolabels', 'Voyager NL'),
+    ('positron_nolabels', 'Positron NL'),
+    ('dark_nolabels', 'Dark NL'),
+    ('osm_de', 'OSM DE'),
+    ('toner_background', 'Toner BG'),
+    ('toner_lines', 'Toner Lines'),
+    ('esri_world_street', 'Esri Street'),
+    ('esri_world_topo', 'Esri Topo'),
+    ('esri_natgeo', 'Nat Geo')
+]
+
+PIN_STYLES = [
+    ('default', 'Blue Pin'),
+    ('burgundy_circle', 'Burgundy Circle'),
+    ('black_circle', 'Black Circle'),
+    ('small_burgundy_pin', 'Burgundy Drop'),
+    ('small_orange_pin', 'Orange Drop'),
+    ('pushpin_emoji', 'Pushpin 📌')
+]
+
+# Decimal places kept for marker coordinates in the page
+COORD_PRECISION = 5
+
+# Book fields copied through to the map as-is (cover is derived separately)
+OPTIONAL_FIELDS = ('author', 'review', 'year', 'genre')
+
 
 def validate_yaml(data):
     """
     Validate YAML structure and data.
+    Coordinates are converted to floats in place.
     Returns (is_valid, errors, warnings)
     """
     errors = []
@@ -62,22 +174,26 @@ def validate_yaml(data):
             errors.append(f"Book {i+1}: Must be a dictionary")
             continue
         
+        # Messages are only formatted when something is reported
+        title = book.get('title', 'Unknown')
+        locations = book.get('locations')
+        
         # Required: title
         if 'title' not in book:
             errors.append(f"Book {i+1}: Missing required field 'title'")
-        elif not isinstance(book['title'], str) or not book['title'].strip():
+        elif not isinstance(title, str) or not title.strip():
             errors.append(f"Book {i+1}: 'title' must be a non-empty string")
         
         # Required: locations
         if 'locations' not in book:
-            errors.append(f"Book {i+1} ('{book.get('title', 'Unknown')}'): Missing required field 'locations'")
-        elif not isinstance(book['locations'], list):
-            errors.append(f"Book {i+1} ('{book.get('title', 'Unknown')}'): 'locations' must be a list")
-        elif len(book['locations']) == 0:
-            errors.append(f"Book {i+1} ('{book.get('title', 'Unknown')}'): 'locations' list cannot be empty")
+            errors.append(f"Book {i+1} ('{title}'): Missing required field 'locations'")
+        elif not isinstance(locations, list):
+            errors.append(f"Book {i+1} ('{title}'): 'locations' must be a list")
+        elif len(locations) == 0:
+            errors.append(f"Book {i+1} ('{title}'): 'locations' list cannot be empty")
         else:
             # Validate each location
-            for j, loc in enumerate(book['locations']):
+            for j, loc in enumerate(locations):
                 if not isinstance(loc, dict):
                     errors.append(f"Book {i+1}, location {j+1}: Must be a dictionary")
                     continue
@@ -90,7 +206,7 @@ def validate_yaml(data):
                 # Validate coordinates if provided
                 if 'lat' in loc:
                     try:
-                        lat = float(loc['lat'])
+                        lat = loc['lat'] = float(loc['lat'])
                         if lat < -90 or lat > 90:
                             errors.append(f"Book {i+1}, location {j+1}: 'lat' must be between -90 and 90")
                     except (ValueError, TypeError):
@@ -98,1142 +214,671 @@ def validate_yaml(data):
                 
                 if 'lng' in loc:
                     try:
-                        lng = float(loc['lng'])
+                        lng = loc['lng'] = float(loc['lng'])
                         if lng < -180 or lng > 180:
                             errors.append(f"Book {i+1}, location {j+1}: 'lng' must be between -180 and 180")
                     except (ValueError, TypeError):
                         errors.append(f"Book {i+1}, location {j+1}: 'lng' must be a number")
         
         # Optional fields validation
-        if 'author' in book and not isinstance(book['author'], str):
-            warnings.append(f"Book {i+1} ('{book.get('title', 'Unknown')}'): 'author' should be a string")
-        
-        if 'cover' in book:
-            if not isinstance(book['cover'], str):
-                warnings.append(f"Book {i+1} ('{book.get('title', 'Unknown')}'): 'cover' should be a string")
-            elif book['cover'] and not re.match(r'^https?://', book['cover']):
-                warnings.append(f"Book {i+1} ('{book.get('title', 'Unknown')}'): 'cover' should be a full URL (starting with http:// or https://)")
-        
-        if 'review' in book:
-            if not isinstance(book['review'], str):
-                warnings.append(f"Book {i+1} ('{book.get('title', 'Unknown')}'): 'review' should be a string")
-            elif book['review'] and not re.match(r'^https?://', book['review']):
-                warnings.append(f"Book {i+1} ('{book.get('title', 'Unknown')}'): 'review' should be a full URL (starting with http:// or https://)")
-        
-        if 'year' in book:
-            if not isinstance(book['year'], (int, str)):
-                warnings.append(f"Book {i+1} ('{book.get('title', 'Unknown')}'): 'year' should be a number or string")
-        
-        if 'genre' in book and not isinstance(book['genre'], str):
-            warnings.append(f"Book {i+1} ('{book.get('title', 'Unknown')}'): 'genre' should be a string")
+        for field, types, description, is_url in OPTIONAL_FIELD_CHECKS:
+            if field not in book:
+                continue
+            value = book[field]
+            if not isinstance(value, types):
+                warnings.append(f"Book {i+1} ('{title}'): '{field}' should be {description}")
+            elif is_url and value and not value.startswith(URL_PREFIXES):
+                warnings.append(f"Book {i+1} ('{title}'): '{field}' should be a full URL (starting with http:// or https://)")
     
     is_valid = len(errors) == 0
     return is_valid, errors, warnings
 
 
 def load_cache():
-    """Load cached geocoding results"""
+    """
+    Load cached geocoding results.
+    The cache is an append-only log with one {key: entry} object per line;
+    later lines win. The log is compacted once it holds more than twice
+    as many lines as live entries.
+    """
+    cache = {}
+    lines = 0
+    damaged = False
+    try:
+        f = open(CACHE_FILE, 'rb')
+    except FileNotFoundError:
+        # Migrate the old single-document JSON cache if there is one
+        try:
+            cache = orjson.loads(Path(LEGACY_CACHE_FILE).read_bytes())
+        except FileNotFoundError:
+            return {}
+        save_cache(cache)
+        return cache
+    with f:
+        for line in f:
+            lines += 1
+            try:
+                entry = orjson.loads(line)
+            except orjson.JSONDecodeError:
+                # Partially written line from an interrupted build
+                damaged = True
+                continue
+            if isinstance(entry, dict) and all(isinstance(value, dict) for value in entry.values()):
+                cache.update(entry)
+            else:
+                # Valid JSON, but not a {key: entry} record
+                damaged = True
+    
+    # Rewrite a damaged log so later appends don't land on the broken line
+    if damaged or lines > 2 * len(cache):
+        save_cache(cache)
+    return cache
+
+
+def append_cache_entry(cache_key, entry):
+    """Append a single geocoding result to the cache log"""
     cache_path = Path(CACHE_FILE)
-    if cache_path.exists():
-        with open(cache_path, 'r') as f:
-            return json.load(f)
-    return {}
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(cache_path, 'ab') as f:
+        f.write(orjson.dumps({cache_key: entry}) + b'\n')
 
 
 def save_cache(cache):
-    """Save geocoding results to cache"""
+    """Rewrite the cache log with one line per entry (compaction)"""
     cache_path = Path(CACHE_FILE)
     cache_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(cache_path, 'w') as f:
-        json.dump(cache, f, indent=2)
+    # Replace the log in one step so a crash mid-write can't lose entries
+    write_atomic(cache_path, b''.join(
+        orjson.dumps({key: cache[key]}) + b'\n' for key in sorted(cache)
+    ))
 
 
-def geocode_location(location_name, cache, geolocator):
+def load_parse_cache(digest):
     """
-    Geocode a location name to coordinates.
-    Uses cache if available, otherwise queries Nominatim.
+    Return (data, warnings) from the last successful validation of
+    books.yaml if its sha256 matches `digest`, otherwise None.
     """
-    # Normalize location name for cache key
-    cache_key = location_name.lower().strip()
-    
-    # Check cache first
-    if cache_key in cache:
-        cached = cache[cache_key]
-        return cached['lat'], cached['lng'], cached['name']
-    
-    # Geocode if not in cache
-    print(f"  Geocoding: {location_name}...")
+    cache_path = Path(PARSE_CACHE_FILE)
+    if not cache_path.exists():
+        return None
     try:
-        time.sleep(GEOCODE_DELAY)  # Rate limiting
-        location = geolocator.geocode(location_name, timeout=10)
-        
-        if location:
-            lat, lng = location.latitude, location.longitude
-            # Cache the result
-            cache[cache_key] = {
-                'lat': lat,
-                'lng': lng,
-                'name': location_name
-            }
-            return lat, lng, location_name
-        else:
-            print(f"  Warning: Could not geocode '{location_name}'")
-            return None, None, location_name
-    except (GeocoderTimedOut, GeocoderServiceError) as e:
-        print(f"  Error geocoding '{location_name}': {e}")
-        return None, None, location_name
+        entry = orjson.loads(cache_path.read_bytes())
+    except orjson.JSONDecodeError:
+        return None
+    if not isinstance(entry, dict) or entry.get('sha256') != digest:
+        return None
+    return entry['data'], entry['warnings']
 
 
-def process_books(books_data, cache):
-    """Process books data, geocoding locations as needed"""
-    geolocator = Nominatim(user_agent="book-location-map")
-    processed_books = []
-    
-    for book in books_data:
-        if 'title' not in book:
-            print(f"Warning: Skipping book without title: {book}")
-            continue
-        
-        if 'locations' not in book or not book['locations']:
-            print(f"Warning: Skipping '{book['title']}' - no locations specified")
-            continue
-        
-        processed_locations = []
-        for loc in book['locations']:
-            if 'name' not in loc:
-                continue
-            
-            # Use provided coordinates or geocode
-            if 'lat' in loc and 'lng' in loc:
-                lat, lng = loc['lat'], loc['lng']
-                location_name = loc['name']
+def save_parse_cache(digest, data, warnings):
+    """Store validated books.yaml data keyed by the sha256 of its source"""
+    try:
+        blob = orjson.dumps({'sha256': digest, 'data': data, 'warnings': warnings})
+    except orjson.JSONEncodeError:
+        return
+    # Only cache data that survives the JSON round trip unchanged (no dates etc.)
+    if orjson.loads(blob)['data'] != data:
+        return
+    Path(PARSE_CACHE_FILE).parent.mkdir(parents=True, exist_ok=True)
+    write_atomic(PARSE_CACHE_FILE, blob)
+
+
+def geocode_delay():
+    """
+    Seconds between geocoding requests. The public server gets
+    GEOCODE_DELAY; a private instance has no usage policy, so it's only
+    throttled if the GEOCODE_DELAY environment variable asks for it.
+    Raises ValueError if that variable isn't a non-negative number.
+    """
+    if not NOMINATIM_DOMAIN:
+        return GEOCODE_DELAY
+    value = os.getenv('GEOCODE_DELAY') or '0'
+    delay = float(value)
+    if not delay >= 0:
+        raise ValueError(value)
+    return delay
+
+
+async def geocode_all(missing, cache, delay=GEOCODE_DELAY):
+    """
+    Geocode uncached location names and store the results in the cache.
+    `missing` maps normalized cache keys to the original location names.
+    Requests are issued concurrently but started no more than once per
+    `delay` seconds, so network round trips overlap the rate-limit wait.
+    """
+    # Imported here so fully cached builds don't pay for the network stack
+    import asyncio
+    import aiohttp
+    from geopy.adapters import AioHTTPAdapter
+    from geopy.exc import GeocoderServiceError
+    from geopy.extra.rate_limiter import AsyncRateLimiter
+    from geopy.geocoders import Nominatim
+    
+    class KeepAliveAdapter(AioHTTPAdapter):
+        """
+        AioHTTPAdapter that sends every request over a single keep-alive
+        connection, so the TLS handshake happens once per build.
+        """
+        
+        @property
+        def session(self):
+            session = self.__dict__.get("session")
+            if session is None:
+                session = aiohttp.ClientSession(
+                    connector=aiohttp.TCPConnector(limit_per_host=1),
+                    trust_env=False,
+                    raise_for_status=False
+                )
+                self.__dict__["session"] = session
+            return session
+    
+    if NOMINATIM_DOMAIN:
+        # A private instance can take requests in parallel. A bare host
+        # is reached over HTTPS; a full URL picks its own scheme
+        scheme, _, domain = NOMINATIM_DOMAIN.rpartition('://')
+        server = {'domain': domain.rstrip('/'), 'scheme': scheme or 'https', 'adapter_factory': AioHTTPAdapter}
+    else:
+        # The public server gets one connection, reused for every request
+        server = {'adapter_factory': KeepAliveAdapter}
+    async with Nominatim(user_agent="book-location-map", **server) as geolocator:
+        geocode = AsyncRateLimiter(
+            geolocator.geocode,
+            min_delay_seconds=delay,
+            max_retries=2,
+            error_wait_seconds=5.0,
+            swallow_exceptions=False
+        )
+        
+        async def geocode_one(cache_key, location_name):
+            try:
+                location = await geocode(location_name, timeout=15)
+            except GeocoderServiceError as e:
+                log.warning("  Error geocoding '%s': %s", location_name, e)
+                location = None
+                error = True
             else:
-                lat, lng, location_name = geocode_location(loc['name'], cache, geolocator)
+                error = False
             
-            if lat is not None and lng is not None:
-                processed_locations.append({
+            if location:
+                # Cache the result and persist it right away
+                cache[cache_key] = {
+                    'lat': location.latitude,
+                    'lng': location.longitude,
+                    'name': location_name
+                }
+                append_cache_entry(cache_key, cache[cache_key])
+                log.debug("  Geocoded: %s", location_name)
+            else:
+                if not error:
+                    log.warning("  Warning: Could not geocode '%s'", location_name)
+                # Remember the failure so later builds don't re-query it right away
+                cache[cache_key] = {
+                    'lat': None,
+                    'lng': None,
                     'name': location_name,
-                    'lat': lat,
-                    'lng': lng
-                })
-        
-        if processed_locations:
-            processed_book = {
-                'title': book['title'],
-                'locations': processed_locations
-            }
-            
-            # Add optional fields
-            if 'author' in book:
-                processed_book['author'] = book['author']
-            
-            # Handle cover image: explicit cover URL or auto-generate from ISBN
-            if 'cover' in book and book['cover']:
-                # Check if it's a local file path (starts with "covers/")
-                if book['cover'].startswith('covers/'):
-                    # Convert to Google Books static link using ISBN
-                    if 'isbn' in book and book['isbn']:
-                        processed_book['cover'] = f"https://books.google.com/books?vid=ISBN{book['isbn']}&printsec=frontcover&img=1&zoom=1"
-                    else:
-                        processed_book['cover'] = book['cover']
-                else:
-                    # Use explicit URL as-is
-                    processed_book['cover'] = book['cover']
-            elif 'isbn' in book and book['isbn']:
-                # Auto-generate cover URL from ISBN using Google Books static link
-                processed_book['cover'] = f"https://books.google.com/books?vid=ISBN{book['isbn']}&printsec=frontcover&img=1&zoom=1"
-            
-            if 'review' in book:
-                processed_book['review'] = book['review']
-            if 'year' in book:
-                processed_book['year'] = book['year']
-            if 'genre' in book:
-                processed_book['genre'] = book['genre']
-            
-            processed_books.append(processed_book)
-    
-    return processed_books
+                    'negative': True,
+                    'ts': time.time()
+                }
+                if error:
+                    cache[cache_key]['error'] = True
+                append_cache_entry(cache_key, cache[cache_key])
+        
+        await asyncio.gather(*(geocode_one(key, name) for key, name in missing.items()))
 
 
-def generate_map_js(books_data, include_style_switcher=False, default_style='positron', default_pin_style='default'):
-    """Generate JavaScript code to initialize the map"""
-    
-    # API key only in preview mode, rely on domain restrictions in production
-    api_key_param = f'?api_key={STADIA_API_KEY}' if (include_style_switcher and STADIA_API_KEY) else ''
-    
-    js = """
-    // Initialize map (temporary view, will be adjusted to fit markers)
-    const map = L.map('map');
+def _is_expired(entry, now, retry_errors=False):
+    """Check whether a negative cache entry should be geocoded again"""
+    if not entry.get('negative'):
+        return False
+    if entry.get('error'):
+        return retry_errors or now - entry.get('ts', 0) >= ERROR_CACHE_TTL
+    return now - entry.get('ts', 0) >= NEGATIVE_CACHE_TTL
+
+
+def _cache_key(name):
+    """Normalized cache key for a location name"""
+    return name.lower().strip()
+
+
+def _collect_missing(books_data, cache, retry_errors=False):
+    """
+    Find location names that need geocoding.
+    Returns {cache_key: location_name} for locations without explicit
+    coordinates that aren't cached yet (or whose failed lookup has
+    expired), deduplicated across all books. With retry_errors, lookups
+    that failed because of geocoder errors always count as missing.
+    """
+    now = time.time()
+    missing = {}
+    for book in books_data:
+        for loc in book.get('locations') or []:
+            if 'name' not in loc or ('lat' in loc and 'lng' in loc):
+                continue
+            cache_key = _cache_key(loc['name'])
+            if cache_key in missing:
+                continue
+            entry = cache.get(cache_key)
+            if entry is None or _is_expired(entry, now, retry_errors):
+                missing[cache_key] = loc['name']
+    return missing
+
+
+def _next_retry(books_data, cache):
+    """
+    Earliest time a "no match" cache entry used by these books expires,
+    or None if there are none. Unchanged builds must not be skipped past
+    this point, or those locations would never be looked up again.
+    """
+    retry_at = None
+    for book in books_data:
+        for loc in book.get('locations') or []:
+            if 'name' not in loc or ('lat' in loc and 'lng' in loc):
+                continue
+            entry = cache.get(_cache_key(loc['name']))
+            if entry and entry.get('negative') and not entry.get('error'):
+                expires = entry.get('ts', 0) + NEGATIVE_CACHE_TTL
+                if retry_at is None or expires < retry_at:
+                    retry_at = expires
+    return retry_at
+
+
+def build_popup_html(book, location_name):
+    """Render the popup HTML for one of a book's locations"""
+    popup = '<div class="book-popup">'
     
-    // Define available tile layers
-    const tileLayers = {
-        'positron': {
-            url: 'https://{s}.basemaps.cartocdn.com/light_all/{z}/{x}/{y}{r}.png',
-            attribution: '&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors &copy; <a href="https://carto.com/attributions">CARTO</a>',
-            options: { subdomains: 'abcd', maxZoom: 19 }
-        },
-        'voyager': {
-            url: 'https://{s}.basemaps.cartocdn.com/rastertiles/voyager/{z}/{x}/{y}{r}.png',
-            attribution: '&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors &copy; <a href="https://carto.com/attributions">CARTO</a>',
-            options: { subdomains: 'abcd', maxZoom: 19 }
-        },
-        'dark': {
-            url: 'https://{s}.basemaps.cartocdn.com/dark_all/{z}/{x}/{y}{r}.png',
-            attribution: '&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors &copy; <a href="https://carto.com/attributions">CARTO</a>',
-            options: { subdomains: 'abcd', maxZoom: 19 }
-        },
-        'osm': {
-            url: 'https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png',
-            attribution: '&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors',
-            options: { maxZoom: 19 }
-        },
-        'humanitarian': {
-            url: 'https://{s}.tile.openstreetmap.fr/hot/{z}/{x}/{y}.png',
-            attribution: '&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors, Tiles style by <a href="https://www.hotosm.org/" target="_blank">Humanitarian OpenStreetMap Team</a>',
-            options: { maxZoom: 19 }
-        },
-        'terrain': {
-            url: 'https://tiles.stadiamaps.com/tiles/stamen_terrain/{z}/{x}/{y}{r}.png""" + api_key_param + """',
-            attribution: '&copy; <a href="https://stadiamaps.com/" target="_blank">Stadia Maps</a> &copy; <a href="https://stamen.com/" target="_blank">Stamen Design</a> &copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors',
-            options: { maxZoom: 18 }
-        },
-        'toner': {
-            url: 'https://tiles.stadiamaps.com/tiles/stamen_toner/{z}/{x}/{y}{r}.png""" + api_key_param + """',
-            attribution: '&copy; <a href="https://stadiamaps.com/" target="_blank">Stadia Maps</a> &copy; <a href="https://stamen.com/" target="_blank">Stamen Design</a> &copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors',
-            options: { maxZoom: 20 }
-        },
-        'watercolor': {
-            url: 'https://tiles.stadiamaps.com/tiles/stamen_watercolor/{z}/{x}/{y}.jpg""" + api_key_param + """',
-            attribution: '&copy; <a href="https://stadiamaps.com/" target="_blank">Stadia Maps</a> &copy; <a href="https://stamen.com/" target="_blank">Stamen Design</a> &copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors',
-            options: { maxZoom: 16 }
-        },
-        'alidade_smooth': {
-            url: 'https://tiles.stadiamaps.com/tiles/alidade_smooth/{z}/{x}/{y}{r}.png""" + api_key_param + """',
-            attribution: '&copy; <a href="https://stadiamaps.com/" target="_blank">Stadia Maps</a> &copy; <a href="https://openmaptiles.org/" target="_blank">OpenMapTiles</a> &copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors',
-            options: { maxZoom: 20 }
-        },
-        'alidade_smooth_dark': {
-            url: 'https://tiles.stadiamaps.com/tiles/alidade_smooth_dark/{z}/{x}/{y}{r}.png""" + api_key_param + """',
-            attribution: '&copy; <a href="https://stadiamaps.com/" target="_blank">Stadia Maps</a> &copy; <a href="https://openmaptiles.org/" target="_blank">OpenMapTiles</a> &copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors',
-            options: { maxZoom: 20 }
-        },
-        'osm_bright': {
-            url: 'https://tiles.stadiamaps.com/tiles/osm_bright/{z}/{x}/{y}{r}.png""" + api_key_param + """',
-            attribution: '&copy; <a href="https://stadiamaps.com/" target="_blank">Stadia Maps</a> &copy; <a href="https://openmaptiles.org/" target="_blank">OpenMapTiles</a> &copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors',
-            options: { maxZoom: 20 }
-        },
-        'outdoors': {
-            url: 'https://tiles.stadiamaps.com/tiles/outdoors/{z}/{x}/{y}{r}.png""" + api_key_param + """',
-            attribution: '&copy; <a href="https://stadiamaps.com/" target="_blank">Stadia Maps</a> &copy; <a href="https://openmaptiles.org/" target="_blank">OpenMapTiles</a> &copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors',
-            options: { maxZoom: 20 }
-        },
-        'opentopomap': {
-            url: 'https://{s}.tile.opentopomap.org/{z}/{x}/{y}.png',
-            attribution: '&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors, <a href="http://viewfinderpanoramas.org">SRTM</a> | Map style: &copy; <a href="https://opentopomap.org">OpenTopoMap</a>',
-            options: { maxZoom: 17 }
-        },
-        'cyclosm': {
-            url: 'https://{s}.tile-cyclosm.openstreetmap.fr/cyclosm/{z}/{x}/{y}.png',
-            attribution: '&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors, Map style: &copy; <a href="https://www.cyclosm.org">CyclOSM</a>',
-            options: { maxZoom: 20 }
-        },
-        'esri_world': {
-            url: 'https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}',
-            attribution: '&copy; <a href="https://www.esri.com/">Esri</a>, Maxar, Earthstar Geographics, and the GIS User Community',
-            options: { maxZoom: 19 }
-        },
-        'wikimedia': {
-            url: 'https://maps.wikimedia.org/osm-intl/{z}/{x}/{y}.png',
-            attribution: '&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors, <a href="https://wikimediafoundation.org/wiki/Maps_Terms_of_Use">Wikimedia maps</a>',
-            options: { maxZoom: 18 }
-        },
-        'toner_lite': {
-            url: 'https://tiles.stadiamaps.com/tiles/stamen_toner_lite/{z}/{x}/{y}{r}.png""" + api_key_param + """',
-            attribution: '&copy; <a href="https://stadiamaps.com/" target="_blank">Stadia Maps</a> &copy; <a href="https://stamen.com/" target="_blank">Stamen Design</a> &copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors',
-            options: { maxZoom: 20 }
-        },
-        'voyager_nolabels': {
-            url: 'https://{s}.basemaps.cartocdn.com/rastertiles/voyager_nolabels/{z}/{x}/{y}{r}.png',
-            attribution: '&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors &copy; <a href="https://carto.com/attributions">CARTO</a>',
-            options: { subdomains: 'abcd', maxZoom: 19 }
-        },
-        'positron_nolabels': {
-            url: 'https://{s}.basemaps.cartocdn.com/light_nolabels/{z}/{x}/{y}{r}.png',
-            attribution: '&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors &copy; <a href="https://carto.com/attributions">CARTO</a>',
-            options: { subdomains: 'abcd', maxZoom: 19 }
-        },
-        'dark_nolabels': {
-            url: 'https://{s}.basemaps.cartocdn.com/dark_nolabels/{z}/{x}/{y}{r}.png',
-            attribution: '&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors &copy; <a href="https://carto.com/attributions">CARTO</a>',
-            options: { subdomains: 'abcd', maxZoom: 19 }
-        },
-        'osm_de': {
-            url: 'https://{s}.tile.openstreetmap.de/{z}/{x}/{y}.png',
-            attribution: '&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors',
-            options: { maxZoom: 18 }
-        },
-        'toner_background': {
-            url: 'https://tiles.stadiamaps.com/tiles/stamen_toner_background/{z}/{x}/{y}{r}.png""" + api_key_param + """',
-            attribution: '&copy; <a href="https://stadiamaps.com/" target="_blank">Stadia Maps</a> &copy; <a href="https://stamen.com/" target="_blank">Stamen Design</a> &copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors',
-            options: { maxZoom: 20 }
-        },
-        'toner_lines': {
-            url: 'https://tiles.stadiamaps.com/tiles/stamen_toner_lines/{z}/{x}/{y}{r}.png""" + api_key_param + """',
-            attribution: '&copy; <a href="https://stadiamaps.com/" target="_blank">Stadia Maps</a> &copy; <a href="https://stamen.com/" target="_blank">Stamen Design</a> &copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors',
-            options: { maxZoom: 20 }
-        },
-        'esri_world_street': {
-            url: 'https://server.arcgisonline.com/ArcGIS/rest/services/World_Street_Map/MapServer/tile/{z}/{y}/{x}',
-            attribution: '&copy; <a href="https://www.esri.com/">Esri</a>',
-            options: { maxZoom: 19 }
-        },
-        'esri_world_topo': {
-            url: 'https://server.arcgisonline.com/ArcGIS/rest/services/World_Topo_Map/MapServer/tile/{z}/{y}/{x}',
-            attribution: '&copy; <a href="https://www.esri.com/">Esri</a>',
-            options: { maxZoom: 19 }
-        },
-        'esri_natgeo': {
-            url: 'https://server.arcgisonline.com/ArcGIS/rest/services/NatGeo_World_Map/MapServer/tile/{z}/{y}/{x}',
-            attribution: '&copy; <a href="https://www.esri.com/">Esri</a>, National Geographic',
-            options: { maxZoom: 16 }
-        }
-        // Additional providers (require API keys):
-        // Mapbox: https://api.mapbox.com/styles/v1/{id}/tiles/{z}/{x}/{y}?access_token={accessToken}
-        // Thunderforest: https://{s}.tile.thunderforest.com/{style}/{z}/{x}/{y}.png?apikey={apikey}
-        // Maptiler: https://api.maptiler.com/maps/{style}/256/{z}/{x}/{y}.png?key={key}
-    };
+    if book.get('cover'):
+        popup += f'<img src="{escape(str(book["cover"]))}" alt="{escape(book["title"])}" class="book-cover" />'
     
-    // Start with configured default style
-    let currentLayer = '""" + default_style + """';
-    let activeLayer = L.tileLayer(tileLayers[currentLayer].url, {
-        attribution: tileLayers[currentLayer].attribution,
-        ...tileLayers[currentLayer].options
-    }).addTo(map);"""
+    popup += '<div class="book-details">'
     
-    if include_style_switcher:
-        js += """
+    if book.get('genre'):
+        popup += f'<p class="genre">{escape(str(book["genre"]))}</p>'
     
-    // Map style switcher function (preview mode only)
-    window.switchStyle = function(styleName) {
-        if (tileLayers[styleName]) {
-            map.removeLayer(activeLayer);
-            currentLayer = styleName;
-            activeLayer = L.tileLayer(tileLayers[currentLayer].url, {
-                attribution: tileLayers[currentLayer].attribution,
-                ...tileLayers[currentLayer].options
-            }).addTo(map);
-            
-            // Update active button
-            document.querySelectorAll('.style-btn').forEach(btn => {
-                btn.classList.remove('active');
-            });
-            document.querySelector(`[data-style="${styleName}"]`).classList.add('active');
-        }
-    };
+    popup += f'<h3>{escape(book["title"])}</h3>'
     
-    // Pin style switcher function (preview mode only)
-    window.switchPinStyle = function(styleName) {
-        if (pinStyles[styleName]) {
-            currentPinStyle = styleName;
-            
-            // Clear and recreate markers
-            markerLayer.clearLayers();
-            
-            markerDataStore.forEach(stored => {
-                const marker = pinStyles[currentPinStyle].createMarker(stored.lat, stored.lng);
-                marker.bindPopup(createPopupContent(stored.markerData));
-                marker.addTo(markerLayer);
-            });
-            
-            // Update active button
-            document.querySelectorAll('.pin-btn').forEach(btn => {
-                btn.classList.remove('active');
-            });
-            document.querySelector(`[data-pin="${styleName}"]`).classList.add('active');
-            
-            // Update offscreen indicators
-            setTimeout(updateOffscreenIndicators, 100);
-        }
-    };
+    if book.get('author'):
+        popup += f'<p class="author">{escape(str(book["author"]))}</p>'
     
-    // Panel toggle function (preview mode only)
-    window.togglePanel = function() {
-        const panel = document.getElementById('stylePanel');
-        panel.classList.toggle('collapsed');
-    };"""
+    popup += f'<p class="location">{escape(location_name)}</p>'
     
-    js += """
+    if book.get('review'):
+        popup += f'<a href="{escape(str(book["review"]))}" target="_blank" class="review-link">Read Erin\'s review</a>'
     
-    // Book data
-    const booksData = """ + json.dumps(books_data, indent=4) + """;
+    popup += '</div>'
+    popup += '</div>'
+    return popup
+
+
+def process_books(books_data, cache, delay=GEOCODE_DELAY):
+    """Process books data, geocoding locations as needed"""
+    # Geocode each unique uncached location once
+    missing = _collect_missing(books_data, cache)
+    if missing:
+        import asyncio
+        print(f"  Geocoding {len(missing)} new locations...")
+        asyncio.run(geocode_all(missing, cache, delay))
+    
+    # Assemble books from explicit coordinates and the cache (no I/O)
+    processed_books = []
     
-    // Define pin styles
-    const pinStyles = {
-        'default': {
-            name: 'Default Blue',
-            createMarker: (lat, lng) => L.marker([lat, lng])
-        },
-        'burgundy_circle': {
-            name: 'Burgundy Circles',
-            createMarker: (lat, lng) => L.circleMarker([lat, lng], {
-                radius: 8,
-                fillColor: '#8B2635',
-                color: '#fff',
-                weight: 2,
-                opacity: 1,
-                fillOpacity: 0.8
-            })
-        },
-        'black_circle': {
-            name: 'Black Circles',
-            createMarker: (lat, lng) => L.circleMarker([lat, lng], {
-                radius: 8,
-                fillColor: '#2c3e50',
-                color: '#fff',
-                weight: 2,
-                opacity: 1,
-                fillOpacity: 0.9
-            })
-        },
-        'small_burgundy_pin': {
-            name: 'Small Burgundy Pin',
-            createMarker: (lat, lng) => {
-                const icon = L.divIcon({
-                    className: 'custom-pin burgundy-pin',
-                    html: '<div class="pin-content"></div>',
-                    iconSize: [20, 32],
-                    iconAnchor: [10, 32],
-                    popupAnchor: [0, -32]
-                });
-                return L.marker([lat, lng], { icon: icon });
-            }
-        },
-        'small_orange_pin': {
-            name: 'Small Orange Pin',
-            createMarker: (lat, lng) => {
-                const icon = L.divIcon({
-                    className: 'custom-pin orange-pin',
-                    html: '<div class="pin-content"></div>',
-                    iconSize: [20, 32],
-                    iconAnchor: [10, 32],
-                    popupAnchor: [0, -32]
-                });
-                return L.marker([lat, lng], { icon: icon });
-            }
-        },
-        'pushpin_emoji': {
-            name: 'Pushpin Emoji',
-            createMarker: (lat, lng) => {
-                const icon = L.divIcon({
-                    className: 'emoji-icon-marker',
-                    html: '<div class="emoji-icon">📌</div>',
-                    iconSize: [30, 30],
-                    iconAnchor: [15, 15],
-                    popupAnchor: [0, -15]
-                });
-                return L.marker([lat, lng], { icon: icon });
-            }
-        }
-    };
+    for book in books_data:
+        processed_book = _process_one(book, cache)
+        if processed_book is not None:
+            processed_books.append(processed_book)
     
-    // Current pin style
-    let currentPinStyle = '""" + default_pin_style + """';
+    return processed_books
+
+
+def _process_one(book, cache):
+    """
+    Assemble one book from explicit coordinates and the cache.
+    Returns None if the book has nothing to put on the map.
+    """
+    if 'title' not in book:
+        log.warning("Warning: Skipping book without title: %s", book)
+        return None
     
-    // Store marker data for recreation
-    let markerDataStore = [];
-    let markerLayer = L.layerGroup().addTo(map);
+    if 'locations' not in book or not book['locations']:
+        log.warning("Warning: Skipping '%s' - no locations specified", book['title'])
+        return None
     
-    // Function to create popup content
-    function createPopupContent(markerData) {
-        let popupContent = '<div class="book-popup">';
-        
-        if (markerData.book.cover) {
-            popupContent += `<img src="${markerData.book.cover}" alt="${markerData.book.title}" class="book-cover" />`;
-        }
-        
-        popupContent += '<div class="book-details">';
-        
-        if (markerData.book.genre) {
-            popupContent += `<p class="genre">${markerData.book.genre}</p>`;
-        }
-        
-        popupContent += `<h3>${markerData.book.title}</h3>`;
-        
-        if (markerData.book.author) {
-            popupContent += `<p class="author">${markerData.book.author}</p>`;
-        }
-        
-        popupContent += `<p class="location">${markerData.location.name}</p>`;
-        
-        if (markerData.book.review) {
-            popupContent += `<a href="${markerData.book.review}" target="_blank" class="review-link">Read Erin's review</a>`;
-        }
-        
-        popupContent += '</div>';
-        popupContent += '</div>';
-        return popupContent;
-    }
-    
-    // Function to create all markers with current style
-    function createMarkers() {
-        // Clear existing markers
-        markerLayer.clearLayers();
-        
-        // Collect all markers with their data
-        const allMarkers = [];
-        booksData.forEach(book => {
-            book.locations.forEach(location => {
-                allMarkers.push({
-                    book: book,
-                    location: location,
-                    lat: location.lat,
-                    lng: location.lng
-                });
-            });
-        });
-        
-        // Detect duplicate coordinates and apply offset
-        const coordCounts = {};
-        const coordOffsets = {};
-        
-        // Count occurrences of each coordinate
-        allMarkers.forEach(marker => {
-            const key = `${marker.lat},${marker.lng}`;
-            coordCounts[key] = (coordCounts[key] || 0) + 1;
-            coordOffsets[key] = 0;
-        });
-        
-        // Create markers with offset for duplicates
-        const bounds = [];
-        markerDataStore = [];
+    processed_locations = []
+    for loc in book['locations']:
+        if 'name' not in loc:
+            continue
         
-        allMarkers.forEach(markerData => {
-            const key = `${markerData.lat},${markerData.lng}`;
-            let lat = markerData.lat;
-            let lng = markerData.lng;
-            
-            // If this coordinate has duplicates, apply a jittery offset
-            if (coordCounts[key] > 1) {
-                const index = coordOffsets[key];
-                const total = coordCounts[key];
-                
-                // Base angle distributed around circle, plus random jitter
-                const baseAngle = (index / total) * 2 * Math.PI;
-                const angleJitter = (Math.random() - 0.5) * Math.PI / 2; // ±45° jitter
-                const angle = baseAngle + angleJitter;
-                
-                // Distance with randomness: 120-280km range
-                const baseOffset = 2.0; // ~200km
-                const distJitter = (Math.random() - 0.5) * 1.6; // ±80km variation
-                const offsetDist = baseOffset + distJitter;
-                
-                lat += offsetDist * Math.cos(angle);
-                lng += offsetDist * Math.sin(angle);
-                
-                coordOffsets[key]++;
-            }
-            
-            // Store for later recreation
-            markerDataStore.push({
-                markerData: markerData,
-                lat: lat,
-                lng: lng
-            });
-            
-            // Create marker with current style
-            const marker = pinStyles[currentPinStyle].createMarker(lat, lng);
-            marker.bindPopup(createPopupContent(markerData));
-            marker.addTo(markerLayer);
-            
-            bounds.push([lat, lng]);
-        });
+        # Use provided coordinates (already floats after validation) or
+        # the cached geocoding result
+        if 'lat' in loc and 'lng' in loc:
+            lat, lng = loc['lat'], loc['lng']
+            location_name = loc['name']
+        else:
+            cached = cache.get(_cache_key(loc['name']))
+            if cached is None:
+                continue
+            lat, lng, location_name = cached['lat'], cached['lng'], cached['name']
         
-        return bounds;
-    }
+        if lat is not None and lng is not None:
+            processed_locations.append({
+                'name': location_name,
+                'lat': lat,
+                'lng': lng
+            })
     
-    // Initial marker creation
-    const bounds = createMarkers();
+    if not processed_locations:
+        return None
     
-    // Set default view (centered on Europe/North America, zoom level 3)
-    // This prevents extreme outliers from forcing a too-wide view
-    // Off-screen indicators will show markers outside this view
-    if (bounds.length > 0) {
-        // Calculate center of all markers
-        let centerLat = bounds.reduce((sum, b) => sum + b[0], 0) / bounds.length;
-        let centerLng = bounds.reduce((sum, b) => sum + b[1], 0) / bounds.length;
-        
-        // Set view with moderate zoom (3 = continent level, good for global view)
-        map.setView([centerLat, centerLng], 3);
+    processed_book = {
+        'title': book['title'],
+        'locations': processed_locations,
+        **{key: book[key] for key in OPTIONAL_FIELDS if key in book}
     }
     
-    // Create offscreen marker indicators
-    const directions = ['north', 'south', 'east', 'west', 'northeast', 'northwest', 'southeast', 'southwest'];
-    const indicators = {};
-    
-    directions.forEach(dir => {
-        const indicator = document.createElement('div');
-        indicator.className = `offscreen-indicator ${dir}`;
-        indicator.id = `indicator-${dir}`;
-        document.getElementById('map').appendChild(indicator);
-        indicators[dir] = indicator;
-    });
+    # Handle cover image: explicit cover URL or auto-generate from ISBN
+    cover = book.get('cover')
+    isbn = book.get('isbn')
+    if cover:
+        # Check if it's a local file path (starts with "covers/")
+        if cover.startswith('covers/'):
+            # Convert to Google Books static link using ISBN
+            if isbn:
+                processed_book['cover'] = f"https://books.google.com/books?vid=ISBN{isbn}&printsec=frontcover&img=1&zoom=1"
+            else:
+                processed_book['cover'] = cover
+        else:
+            # Use explicit URL as-is
+            processed_book['cover'] = cover
+    elif isbn:
+        # Auto-generate cover URL from ISBN using Google Books static link
+        processed_book['cover'] = f"https://books.google.com/books?vid=ISBN{isbn}&printsec=frontcover&img=1&zoom=1"
     
-    // Store all marker positions for offscreen tracking
-    const allMarkerPositions = bounds.map(pos => ({ lat: pos[0], lng: pos[1] }));
+    # Prerender popup HTML so the browser doesn't build it per marker
+    for loc in processed_locations:
+        loc['popup'] = build_popup_html(processed_book, loc['name'])
     
-    // Function to update offscreen indicators
-    function updateOffscreenIndicators() {
-        const mapBounds = map.getBounds();
-        const counts = {
-            north: 0, south: 0, east: 0, west: 0,
-            northeast: 0, northwest: 0, southeast: 0, southwest: 0
-        };
+    return processed_book
+
+
+def spread_duplicates(markers):
+    """
+    Fan out markers that share exact coordinates in a jittered ring
+    (1.2-2.8° out) so each pin can be clicked. The jitter is
+    seeded by the shared coordinates, so rebuilds place pins identically.
+    """
+    counts = Counter((m['lat'], m['lng']) for m in markers)
+    placed = Counter()
+    rngs = {}
+    
+    for marker in markers:
+        key = (marker['lat'], marker['lng'])
+        total = counts[key]
+        if total < 2:
+            continue
         
-        allMarkerPositions.forEach(pos => {
-            if (!mapBounds.contains([pos.lat, pos.lng])) {
-                const isNorth = pos.lat > mapBounds.getNorth();
-                const isSouth = pos.lat < mapBounds.getSouth();
-                const isEast = pos.lng > mapBounds.getEast();
-                const isWest = pos.lng < mapBounds.getWest();
-                
-                // Determine direction
-                if (isNorth && isEast) counts.northeast++;
-                else if (isNorth && isWest) counts.northwest++;
-                else if (isSouth && isEast) counts.southeast++;
-                else if (isSouth && isWest) counts.southwest++;
-                else if (isNorth) counts.north++;
-                else if (isSouth) counts.south++;
-                else if (isEast) counts.east++;
-                else if (isWest) counts.west++;
-            }
-        });
+        index = placed[key]
+        placed[key] += 1
+        rng = rngs.setdefault(key, random.Random(f"{key[0]},{key[1]}"))
         
-        // Update indicator visibility and text
-        Object.keys(counts).forEach(dir => {
-            const indicator = indicators[dir];
-            if (counts[dir] > 0) {
-                indicator.textContent = counts[dir];
-                indicator.classList.add('visible');
-            } else {
-                indicator.classList.remove('visible');
-            }
-        });
-    }
+        # Base angle distributed around circle, plus ±45° jitter
+        angle = index / total * 2 * math.pi + (rng.random() - 0.5) * math.pi / 2
+        # 2.0° ±0.8° (about 220 km ±90 km north-south)
+        distance = 2.0 + (rng.random() - 0.5) * 1.6
+        
+        marker['lat'] = key[0] + distance * math.cos(angle)
+        marker['lng'] = key[1] + distance * math.sin(angle)
+
+
+def generate_map_js(center, include_style_switcher=False, default_style='positron', default_pin_style='default'):
+    """Generate JavaScript code to initialize the map"""
     
-    // Update indicators on map movement
-    map.on('moveend', updateOffscreenIndicators);
-    map.on('zoomend', updateOffscreenIndicators);
+    # API key only in preview mode, rely on domain restrictions in production
+    api_key_param = f'?api_key={STADIA_API_KEY}' if (include_style_switcher and STADIA_API_KEY) else ''
     
-    // Initial update after a delay (to let map settle)
-    setTimeout(updateOffscreenIndicators, 200);
+    template = TEMPLATE_ENV.get_template(Path(MAP_JS_TEMPLATE_FILE).name)
+    return template.render(
+        center=center,
+        include_style_switcher=include_style_switcher,
+        default_style=default_style,
+        default_pin_style=default_pin_style,
+        api_key_param=api_key_param
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _read_text(path, mtime_ns):
+    """Read a text file; callers pass the mtime so edits miss the cache"""
+    return Path(path).read_text()
+
+
+def read_css():
+    """Contents of CSS_FILE, or "" if it doesn't exist"""
+    try:
+        mtime_ns = os.stat(CSS_FILE).st_mtime_ns
+    except FileNotFoundError:
+        return ""
+    return _read_text(CSS_FILE, mtime_ns)
+
+
+def generate_marker_data(books_data):
+    """
+    Serialize one entry per pin for the page's marker data block and
+    find the mean pin position to center the map on (None if there are
+    no pins). Neither depends on the page mode, so they're built once.
+    Returns (markers_json, center).
     """
-    return js
+    markers = [
+        {'lat': loc['lat'], 'lng': loc['lng'], 'popup': loc['popup']}
+        for book in books_data
+        for loc in book['locations']
+    ]
+    spread_duplicates(markers)
+    
+    # Five decimal places is about a metre, far finer than a pin; longer
+    # coordinates only add bytes for the browser to download and parse
+    for marker in markers:
+        marker['lat'] = round(marker['lat'], COORD_PRECISION)
+        marker['lng'] = round(marker['lng'], COORD_PRECISION)
+    
+    center = None
+    if markers:
+        center = (
+            round(sum(m['lat'] for m in markers) / len(markers), COORD_PRECISION),
+            round(sum(m['lng'] for m in markers) / len(markers), COORD_PRECISION)
+        )
+    
+    # Escape "</" so the prerendered popup HTML can't close the script tag
+    return orjson.dumps(markers).decode('utf-8').replace('</', '<\\/'), center
 
 
-def generate_html(books_data, preview_mode=False, default_style='positron', default_pin_style='default'):
+def generate_html(markers_json, center, preview_mode=False, default_style='positron', default_pin_style='default', minify=False):
     """Generate the HTML file with embedded map"""
-    map_js = generate_map_js(books_data, include_style_switcher=preview_mode, default_style=default_style, default_pin_style=default_pin_style)
-    
-    # Read CSS if it exists
-    css_content = ""
-    css_path = Path(CSS_FILE)
-    if css_path.exists():
-        with open(css_path, 'r') as f:
-            css_content = f.read()
-    
-    html = f"""<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Book Locations Map</title>
-    
-    <!-- Leaflet CSS -->
-    <link rel="stylesheet" href="https://unpkg.com/leaflet@1.9.4/dist/leaflet.css" />
-    
-    <!-- Custom CSS -->
-    <style>
-        * {{
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }}
-        
-        body {{
-            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, Oxygen, Ubuntu, Cantarell, sans-serif;
-        }}
-        
-        #map {{
-            width: 100%;
-            height: 100vh;
-        }}
-        
-        .leaflet-popup-close-button {{
-            top: 6px !important;
-            right: 6px !important;
-        }}
-        
-        .book-popup {{
-            display: flex;
-            gap: 12px;
-            min-width: 250px;
-            max-width: 350px;
-        }}
-        
-        .book-popup .book-cover {{
-            width: 80px;
-            height: auto;
-            flex-shrink: 0;
-            border-radius: 4px;
-            align-self: flex-start;
-        }}
-        
-        .book-popup .book-details {{
-            display: flex;
-            flex-direction: column;
-            gap: 2px;
-            flex-grow: 1;
-        }}
-        
-        .book-popup .genre {{
-            font-size: 10pt;
-            color: #888;
-            margin: 0 0 2px 0;
-            font-style: italic;
-        }}
-        
-        .book-popup h3 {{
-            font-size: 16pt;
-            margin: 0;
-            color: #000;
-            line-height: 1.1;
-        }}
-        
-        .book-popup .author {{
-            font-size: 16pt;
-            color: #000;
-            margin: 0;
-            line-height: 1.1;
-        }}
-        
-        .book-popup .location {{
-            font-size: 10pt;
-            color: #888;
-            margin: 2px 0 0 0;
-        }}
-        
-        .book-popup .review-link {{
-            font-size: 10pt;
-            color: #007bff;
-            text-decoration: none;
-            margin-top: auto;
-            display: inline-block;
-            align-self: flex-end;
-        }}
-        
-        .book-popup .review-link::after {{
-            content: ' →';
-        }}
-        
-        .book-popup .review-link:hover {{
-            text-decoration: underline;
-        }}
-        
-        /* Offscreen marker indicators */
-        .offscreen-indicator {{
-            position: absolute;
-            background-color: rgba(0, 123, 255, 0.9);
-            color: white;
-            padding: 8px 12px;
-            border-radius: 20px;
-            font-size: 13px;
-            font-weight: bold;
-            pointer-events: none;
-            z-index: 1000;
-            box-shadow: 0 2px 8px rgba(0,0,0,0.3);
-            display: none;
-            white-space: nowrap;
-        }}
-        
-        .offscreen-indicator.visible {{
-            display: block;
-        }}
-        
-        .offscreen-indicator::before {{
-            content: '→';
-            margin-right: 4px;
-        }}
-        
-        .offscreen-indicator.north {{
-            top: 20px;
-            left: 50%;
-            transform: translateX(-50%);
-        }}
-        
-        .offscreen-indicator.north::before {{
-            content: '↑';
-        }}
-        
-        .offscreen-indicator.south {{
-            bottom: 20px;
-            left: 50%;
-            transform: translateX(-50%);
-        }}
-        
-        .offscreen-indicator.south::before {{
-            content: '↓';
-        }}
-        
-        .offscreen-indicator.east {{
-            top: 50%;
-            right: 20px;
-            transform: translateY(-50%);
-        }}
-        
-        .offscreen-indicator.west {{
-            top: 50%;
-            left: 20px;
-            transform: translateY(-50%);
-        }}
-        
-        .offscreen-indicator.west::before {{
-            content: '←';
-        }}
-        
-        .offscreen-indicator.northeast {{
-            top: 20px;
-            right: 20px;
-        }}
-        
-        .offscreen-indicator.northeast::before {{
-            content: '↗';
-        }}
-        
-        .offscreen-indicator.northwest {{
-            top: 20px;
-            left: 20px;
-        }}
-        
-        .offscreen-indicator.northwest::before {{
-            content: '↖';
-        }}
-        
-        .offscreen-indicator.southeast {{
-            bottom: 20px;
-            right: 20px;
-        }}
-        
-        .offscreen-indicator.southeast::before {{
-            content: '↘';
-        }}
-        
-        .offscreen-indicator.southwest {{
-            bottom: 20px;
-            left: 20px;
-        }}
-        
-        .offscreen-indicator.southwest::before {{
-            content: '↙';
-        }}
-        
-        /* Custom pin styles */
-        .custom-pin {{
-            background: transparent;
-            border: none;
-        }}
-        
-        .custom-pin .pin-content {{
-            width: 20px;
-            height: 32px;
-            position: relative;
-        }}
-        
-        .custom-pin .pin-content::before {{
-            content: '';
-            position: absolute;
-            width: 20px;
-            height: 20px;
-            border-radius: 50% 50% 50% 0;
-            transform: rotate(-45deg);
-            left: 0;
-            top: 0;
-        }}
-        
-        .custom-pin .pin-content::after {{
-            content: '';
-            position: absolute;
-            width: 8px;
-            height: 8px;
-            border-radius: 50%;
-            background: white;
-            left: 6px;
-            top: 6px;
-        }}
-        
-        .burgundy-pin .pin-content::before {{
-            background: #8B2635;
-            border: 2px solid white;
-            box-shadow: 0 2px 5px rgba(0,0,0,0.3);
-        }}
-        
-        .orange-pin .pin-content::before {{
-            background: #D2691E;
-            border: 2px solid white;
-            box-shadow: 0 2px 5px rgba(0,0,0,0.3);
-        }}
-        
-        .emoji-icon-marker {{
-            background: transparent;
-            border: none;
-            text-align: center;
-        }}
-        
-        .emoji-icon-marker .emoji-icon {{
-            font-size: 24px;
-            filter: drop-shadow(0 2px 3px rgba(0,0,0,0.4));
-        }}
-        
-        {css_content}"""
-    
-    # Add preview-specific styles
-    if preview_mode:
-        html += """
-        
-        /* Combined style chooser panel (preview mode only) */
-        .style-panel {
-            position: fixed;
-            top: 8px;
-            right: 8px;
-            background: white;
-            border-radius: 4px;
-            box-shadow: 0 2px 6px rgba(0,0,0,0.15);
-            z-index: 1000;
-            max-width: 240px;
-            transition: all 0.3s ease;
-        }
-        
-        .style-panel.collapsed .panel-content {
-            display: none;
-        }
-        
-        .panel-toggle {
-            padding: 6px 10px;
-            background: #007bff;
-            color: white;
-            border: none;
-            border-radius: 4px;
-            cursor: pointer;
-            font-size: 11px;
-            font-weight: 600;
-            width: 100%;
-            text-align: left;
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-            transition: background 0.2s;
-        }
-        
-        .panel-toggle:hover {
-            background: #0056b3;
-        }
-        
-        .toggle-icon {
-            font-size: 10px;
-            transition: transform 0.3s;
-        }
-        
-        .style-panel.collapsed .toggle-icon {
-            transform: rotate(180deg);
-        }
-        
-        .panel-content {
-            padding: 8px;
-        }
-        
-        .panel-section {
-            margin-bottom: 10px;
-        }
-        
-        .panel-section:last-child {
-            margin-bottom: 0;
-        }
-        
-        .panel-section h3 {
-            margin: 0 0 5px 0;
-            font-size: 10px;
-            color: #666;
-            font-weight: 600;
-            text-transform: uppercase;
-            letter-spacing: 0.5px;
-        }
-        
-        .note {
-            font-size: 8px;
-            color: #999;
-            margin-bottom: 8px;
-            font-style: italic;
-            text-align: center;
-        }
-        
-        .style-grid {
-            display: grid;
-            grid-template-columns: 1fr 1fr 1fr;
-            gap: 3px;
-        }
-        
-        .pin-grid {
-            display: flex;
-            flex-direction: column;
-            gap: 3px;
-        }
-        
-        .style-btn,
-        .pin-btn {
-            padding: 5px 3px;
-            border: 1px solid #ddd;
-            background: white;
-            border-radius: 2px;
-            cursor: pointer;
-            font-size: 9px;
-            transition: all 0.2s;
-            text-align: center;
-            line-height: 1.2;
-        }
-        
-        .style-btn:hover,
-        .pin-btn:hover {
-            border-color: #007bff;
-            background: #f8f9fa;
-        }
-        
-        .style-btn.active,
-        .pin-btn.active {
-            border-color: #007bff;
-            background: #007bff;
-            color: white;
-            font-weight: bold;
-        }"""
-    
-    html += """
-    </style>
-</head>
-<body>
-    <div id="map"></div>"""
-    
-    # Add style chooser panel in preview mode
-    if preview_mode:
-        # Generate buttons with active class on default style
-        styles = [
-            ('positron', 'Positron'),
-            ('voyager', 'Voyager'),
-            ('dark', 'Dark'),
-            ('osm', 'OSM'),
-            ('humanitarian', 'HOT'),
-            ('terrain', 'Terrain'),
-            ('toner', 'Toner'),
-            ('watercolor', 'Watercolor'),
-            ('alidade_smooth', 'Alidade'),
-            ('alidade_smooth_dark', 'Alidade Dark'),
-            ('osm_bright', 'OSM Bright'),
-            ('outdoors', 'Outdoors'),
-            ('opentopomap', 'TopoMap'),
-            ('cyclosm', 'CyclOSM'),
-            ('esri_world', 'Satellite'),
-            ('wikimedia', 'Wikimedia'),
-            ('toner_lite', 'Toner Lite'),
-            ('voyager_nolabels', 'Voyager NL'),
-            ('positron_nolabels', 'Positron NL'),
-            ('dark_nolabels', 'Dark NL'),
-            ('osm_de', 'OSM DE'),
-            ('toner_background', 'Toner BG'),
-            ('toner_lines', 'Toner Lines'),
-            ('esri_world_street', 'Esri Street'),
-            ('esri_world_topo', 'Esri Topo'),
-            ('esri_natgeo', 'Nat Geo')
-        ]
-        
-        buttons_html = ""
-        for style_id, style_name in styles:
-            active_class = " active" if style_id == default_style else ""
-            buttons_html += f'            <button class="style-btn{active_class}" data-style="{style_id}" onclick="switchStyle(\'{style_id}\')">{style_name}</button>\n'
-        
-        # Generate pin style buttons
-        pin_styles_list = [
-            ('default', 'Blue Pin'),
-            ('burgundy_circle', 'Burgundy Circle'),
-            ('black_circle', 'Black Circle'),
-            ('small_burgundy_pin', 'Burgundy Drop'),
-            ('small_orange_pin', 'Orange Drop'),
-            ('pushpin_emoji', 'Pushpin 📌')
-        ]
-        
-        pin_buttons_html = ""
-        for pin_id, pin_name in pin_styles_list:
-            active_class = " active" if pin_id == default_pin_style else ""
-            pin_buttons_html += f'            <button class="pin-btn{active_class}" data-pin="{pin_id}" onclick="switchPinStyle(\'{pin_id}\')">{pin_name}</button>\n'
-        
-        html += f"""
-    
-    <!-- Combined Style Panel (preview mode only) -->
-    <div class="style-panel" id="stylePanel">
-        <button class="panel-toggle" onclick="togglePanel()">
-            <span>Map & Pin Styles</span>
-            <span class="toggle-icon">▼</span>
-        </button>
-        <div class="panel-content">
-            <p class="note">Preview only - not included in production</p>
-            
-            <div class="panel-section">
-                <h3>Pin Styles</h3>
-                <div class="pin-grid">
-{pin_buttons_html.rstrip()}
-                </div>
-            </div>
-            
-            <div class="panel-section">
-                <h3>Map Tiles</h3>
-                <div class="style-grid">
-{buttons_html.rstrip()}
-                </div>
-            </div>
-        </div>
-    </div>"""
-    
-    html += f"""
-    
-    <!-- Leaflet JS -->
-    <script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"></script>
-    
-    <!-- Map initialization -->
-    <script>
-{map_js}
-    </script>
-</body>
-</html>"""
-    
-    return html
+    map_js = generate_map_js(center, include_style_switcher=preview_mode, default_style=default_style, default_pin_style=default_pin_style)
+    page_css = TEMPLATE_ENV.get_template(Path(STYLE_TEMPLATE_FILE).name).render(
+        preview_mode=preview_mode,
+        css_content=read_css()
+    )
+    
+    if minify:
+        if rjsmin is not None:
+            map_js = rjsmin.jsmin(map_js)
+        if rcssmin is not None:
+            page_css = rcssmin.cssmin(page_css)
+    
+    template = TEMPLATE_ENV.get_template(Path(TEMPLATE_FILE).name)
+    return template.render(
+        preview_mode=preview_mode,
+        default_style=default_style,
+        default_pin_style=default_pin_style,
+        map_styles=MAP_STYLES,
+        pin_styles=PIN_STYLES,
+        page_css=page_css,
+        markers_json=markers_json,
+        map_js=map_js
+    )
+
+
+def write_atomic(path, data):
+    """
+    Write bytes to a temporary file and rename it over `path`, so readers
+    never see a partially written file.
+    """
+    path = Path(path)
+    # Per-process name so two builds running at once can't share a temp file
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            tmp_path.unlink()
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def write_compressed_copies(path, data):
+    """
+    Write pre-compressed copies of an output file's bytes next to it
+    (.gz, plus .br when brotli is installed) for hosts that serve them.
+    """
+    # GzipFile rather than gzip.compress, whose mtime argument needs Python 3.8
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=9, mtime=0) as gz:
+        gz.write(data)
+    write_atomic(f"{path}.gz", buffer.getvalue())
+    if brotli is not None:
+        write_atomic(f"{path}.br", brotli.compress(data, quality=11))
+
+
+def build_signature(minify=False, retry_at=None):
+    """
+    Modification time and size of every file that affects the output, plus
+    the settings that may come from the environment instead of config.py
+    (hashed, so the API key isn't written out in plain text). `retry_at`
+    is when the earliest "no match" cache entry expires; once it passes,
+    the output counts as stale even if no file changed.
+    """
+    settings = f"{STADIA_API_KEY}\n{NOMINATIM_DOMAIN}".encode('utf-8')
+    signature = {'minify': minify, 'settings': hashlib.sha256(settings).hexdigest()}
+    if retry_at is not None:
+        signature['retry_at'] = retry_at
+    for name in (INPUT_FILE, CACHE_FILE, TEMPLATE_FILE, STYLE_TEMPLATE_FILE, MAP_JS_TEMPLATE_FILE, CSS_FILE, __file__, "config.py"):
+        path = Path(name)
+        if path.exists():
+            stat = path.stat()
+            signature[str(path)] = [stat.st_mtime_ns, stat.st_size]
+    return signature
+
+
+def is_up_to_date(minify=False):
+    """Check whether the output was built from the current input files"""
+    stamp_path = Path(BUILD_STAMP_FILE)
+    output_path = Path(OUTPUT_DIR)
+    if not (stamp_path.exists() and (output_path / "index.html").exists() and (output_path / "preview.html").exists()):
+        return False
+    try:
+        stamp = orjson.loads(stamp_path.read_bytes())
+    except orjson.JSONDecodeError:
+        return False
+    if not isinstance(stamp, dict):
+        return False
+    retry_at = stamp.get('retry_at')
+    if retry_at is not None and time.time() >= retry_at:
+        return False
+    return stamp == build_signature(minify, retry_at)
 
 
 def main():
     """Main build function"""
+    parser = argparse.ArgumentParser(description='Build the book location map from books.yaml')
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='Rebuild even if no input files have changed'
+    )
+    parser.add_argument(
+        '--check',
+        action='store_true',
+        help='Only report whether a rebuild is needed (exit status 1 if so)'
+    )
+    parser.add_argument(
+        '--minify',
+        action='store_true',
+        help='Minify the embedded JavaScript and CSS in index.html (needs rjsmin/rcssmin)'
+    )
+    parser.add_argument(
+        '--verbose',
+        action='store_true',
+        help='Show each location as it is geocoded'
+    )
+    args = parser.parse_args()
+    
+    # BOOKMAP_LOG=DEBUG is equivalent to --verbose
+    level_name = 'DEBUG' if args.verbose else (os.getenv('BOOKMAP_LOG') or 'INFO').upper()
+    # getLevelName maps known names to ints and returns a string otherwise
+    log_level = logging.getLevelName(level_name)
+    known_level = isinstance(log_level, int)
+    # Only our logger gets the level; the root logger stays at WARNING so
+    # --verbose doesn't turn on asyncio/geopy debug output
+    logging.basicConfig(format='%(message)s')
+    log.setLevel(log_level if known_level else logging.INFO)
+    if not known_level:
+        log.warning("Warning: Unknown BOOKMAP_LOG level '%s', using INFO", level_name)
+    
+    if args.minify and (rjsmin is None or rcssmin is None):
+        print("Warning: --minify needs the rjsmin and rcssmin packages; missing code is left as-is")
+    
+    if args.check:
+        if is_up_to_date(args.minify):
+            print("Output is up to date")
+            sys.exit(0)
+        print("Output is out of date; run build.py to rebuild")
+        sys.exit(1)
+    
+    if not args.force and is_up_to_date(args.minify):
+        print("Output is up to date (use --force to rebuild)")
+        return
+    
+    # Read here rather than at import so a typo can't break --check
+    try:
+        delay = geocode_delay()
+    except ValueError:
+        print(f"❌ Error: GEOCODE_DELAY must be a non-negative number of seconds, got '{os.getenv('GEOCODE_DELAY')}'")
+        sys.exit(1)
+    
     print("Building book location map...")
     
     # Load books data
     print(f"Loading {INPUT_FILE}...")
     try:
-        with open(INPUT_FILE, 'r') as f:
-            data = yaml.safe_load(f)
-    except yaml.YAMLError as e:
-        print(f"❌ Error: Invalid YAML syntax in {INPUT_FILE}")
-        print(f"   {e}")
-        sys.exit(1)
+        source = Path(INPUT_FILE).read_bytes()
     except FileNotFoundError:
         print(f"❌ Error: File not found: {INPUT_FILE}")
         sys.exit(1)
     
-    # Validate YAML structure and data
-    print("Validating YAML structure...")
-    is_valid, errors, warnings = validate_yaml(data)
+    # Reuse the last validated parse if neither books.yaml nor the
+    # validation rules in this script have changed
+    digest = hashlib.sha256(source + Path(__file__).read_bytes()).hexdigest()
+    parsed = load_parse_cache(digest)
+    if parsed is not None:
+        data, warnings = parsed
+        is_valid, errors = True, []
+        print("Validating YAML structure... (unchanged, using cached result)")
+    else:
+        if YAMLLoader is yaml.SafeLoader:
+            print("Note: PyYAML was built without libyaml; parsing will be slower (see README)")
+        try:
+            data = yaml.load(source, Loader=YAMLLoader)
+        except yaml.YAMLError as e:
+            print(f"❌ Error: Invalid YAML syntax in {INPUT_FILE}")
+            print(f"   {e}")
+            sys.exit(1)
+        
+        # Validate YAML structure and data
+        print("Validating YAML structure...")
+        is_valid, errors, warnings = validate_yaml(data)
+        if is_valid:
+            save_parse_cache(digest, data, warnings)
     
     if warnings:
         print(f"\n⚠️  Warnings ({len(warnings)}):")
@@ -1261,10 +906,9 @@ def main():
     
     # Process books (geocode locations)
     print("Processing books and geocoding locations...")
-    processed_books = process_books(books, cache)
+    processed_books = process_books(books, cache, delay)
     
-    # Save cache
-    save_cache(cache)
+    # New results were appended to the cache log as they arrived
     print(f"Cached {len(cache)} locations")
     
     # Get default style from config (default to 'positron' if not specified)
@@ -1279,26 +923,44 @@ def main():
     output_path = Path(OUTPUT_DIR)
     output_path.mkdir(parents=True, exist_ok=True)
     
+    # Marker data is the same for both pages
+    markers_json, center = generate_marker_data(processed_books)
+    
     # Generate production HTML (clean, no style chooser)
     print("Generating production HTML...")
-    html_production = generate_html(processed_books, preview_mode=False, default_style=default_style, default_pin_style=default_pin_style)
+    html_production = generate_html(markers_json, center, preview_mode=False, default_style=default_style, default_pin_style=default_pin_style, minify=args.minify)
     output_file = output_path / "index.html"
-    with open(output_file, 'w') as f:
-        f.write(html_production)
-    print(f"✓ Generated {output_file} (production)")
+    production_bytes = html_production.encode('utf-8')
+    write_atomic(output_file, production_bytes)
+    write_compressed_copies(output_file, production_bytes)
+    print(f"✓ Generated {output_file} (production, plus compressed copies)")
     
     # Generate preview HTML (with style chooser)
     print("Generating preview HTML...")
-    html_preview = generate_html(processed_books, preview_mode=True, default_style=default_style, default_pin_style=default_pin_style)
+    html_preview = generate_html(markers_json, center, preview_mode=True, default_style=default_style, default_pin_style=default_pin_style)
     preview_file = output_path / "preview.html"
-    with open(preview_file, 'w') as f:
-        f.write(html_preview)
+    write_atomic(preview_file, html_preview.encode('utf-8'))
     print(f"✓ Generated {preview_file} (with style chooser)")
     
+    # Record the inputs this output was built from, unless some locations
+    # failed to geocode because of errors and should be retried next run
+    if _collect_missing(books, cache, retry_errors=True):
+        try:
+            Path(BUILD_STAMP_FILE).unlink()
+        except FileNotFoundError:
+            pass
+    else:
+        signature = build_signature(args.minify, _next_retry(books, cache))
+        write_atomic(BUILD_STAMP_FILE, orjson.dumps(signature))
+    
     # Summary statistics
-    total_locations = sum(len(book['locations']) for book in processed_books)
-    books_with_covers = sum(1 for book in processed_books if 'cover' in book and book['cover'])
-    books_with_reviews = sum(1 for book in processed_books if 'review' in book and book['review'])
+    total_locations = books_with_covers = books_with_reviews = 0
+    for book in processed_books:
+        total_locations += len(book['locations'])
+        if book.get('cover'):
+            books_with_covers += 1
+        if book.get('review'):
+            books_with_reviews += 1
     
     print(f"\n📊 Summary:")
     print(f"   - Books: {len(processed_books)}")
@@ -0,0 +1,388 @@
+
+    // Initialize map (temporary view, will be adjusted to fit markers)
+    // Draw circle pins on one shared canvas instead of an SVG element each
+    const map = L.map('map', { preferCanvas: true });
+    
+    // Define available tile layers
+    const tileLayers = {
+        'positron': {
+            url: 'https://{s}.basemaps.cartocdn.com/light_all/{z}/{x}/{y}{r}.png',
+            attribution: '&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors &copy; <a href="https://carto.com/attributions">CARTO</a>',
+            options: { subdomains: 'abcd', maxZoom: 19 }
+        },
+        'voyager': {
+            url: 'https://{s}.basemaps.cartocdn.com/rastertiles/voyager/{z}/{x}/{y}{r}.png',
+            attribution: '&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors &copy; <a href="https://carto.com/attributions">CARTO</a>',
+            options: { subdomains: 'abcd', maxZoom: 19 }
+        },
+        'dark': {
+            url: 'https://{s}.basemaps.cartocdn.com/dark_all/{z}/{x}/{y}{r}.png',
+            attribution: '&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors &copy; <a href="https://carto.com/attributions">CARTO</a>',
+            options: { subdomains: 'abcd', maxZoom: 19 }
+        },
+        'osm': {
+            url: 'https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png',
+            attribution: '&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors',
+            options: { maxZoom: 19 }
+        },
+        'humanitarian': {
+            url: 'https://{s}.tile.openstreetmap.fr/hot/{z}/{x}/{y}.png',
+            attribution: '&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors, Tiles style by <a href="https://www.hotosm.org/" target="_blank">Humanitarian OpenStreetMap Team</a>',
+            options: { maxZoom: 19 }
+        },
+        'terrain': {
+            url: 'https://tiles.stadiamaps.com/tiles/stamen_terrain/{z}/{x}/{y}{r}.png{{ api_key_param }}',
+            attribution: '&copy; <a href="https://stadiamaps.com/" target="_blank">Stadia Maps</a> &copy; <a href="https://stamen.com/" target="_blank">Stamen Design</a> &copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors',
+            options: { maxZoom: 18 }
+        },
+        'toner': {
+            url: 'https://tiles.stadiamaps.com/tiles/stamen_toner/{z}/{x}/{y}{r}.png{{ api_key_param }}',
+            attribution: '&copy; <a href="https://stadiamaps.com/" target="_blank">Stadia Maps</a> &copy; <a href="https://stamen.com/" target="_blank">Stamen Design</a> &copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors',
+            options: { maxZoom: 20 }
+        },
+        'watercolor': {
+            url: 'https://tiles.stadiamaps.com/tiles/stamen_watercolor/{z}/{x}/{y}.jpg{{ api_key_param }}',
+            attribution: '&copy; <a href="https://stadiamaps.com/" target="_blank">Stadia Maps</a> &copy; <a href="https://stamen.com/" target="_blank">Stamen Design</a> &copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors',
+            options: { maxZoom: 16 }
+        },
+        'alidade_smooth': {
+            url: 'https://tiles.stadiamaps.com/tiles/alidade_smooth/{z}/{x}/{y}{r}.png{{ api_key_param }}',
+            attribution: '&copy; <a href="https://stadiamaps.com/" target="_blank">Stadia Maps</a> &copy; <a href="https://openmaptiles.org/" target="_blank">OpenMapTiles</a> &copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors',
+            options: { maxZoom: 20 }
+        },
+        'alidade_smooth_dark': {
+            url: 'https://tiles.stadiamaps.com/tiles/alidade_smooth_dark/{z}/{x}/{y}{r}.png{{ api_key_param }}',
+            attribution: '&copy; <a href="https://stadiamaps.com/" target="_blank">Stadia Maps</a> &copy; <a href="https://openmaptiles.org/" target="_blank">OpenMapTiles</a> &copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors',
+            options: { maxZoom: 20 }
+        },
+        'osm_bright': {
+            url: 'https://tiles.stadiamaps.com/tiles/osm_bright/{z}/{x}/{y}{r}.png{{ api_key_param }}',
+            attribution: '&copy; <a href="https://stadiamaps.com/" target="_blank">Stadia Maps</a> &copy; <a href="https://openmaptiles.org/" target="_blank">OpenMapTiles</a> &copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors',
+            options: { maxZoom: 20 }
+        },
+        'outdoors': {
+            url: 'https://tiles.stadiamaps.com/tiles/outdoors/{z}/{x}/{y}{r}.png{{ api_key_param }}',
+            attribution: '&copy; <a href="https://stadiamaps.com/" target="_blank">Stadia Maps</a> &copy; <a href="https://openmaptiles.org/" target="_blank">OpenMapTiles</a> &copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors',
+            options: { maxZoom: 20 }
+        },
+        'opentopomap': {
+            url: 'https://{s}.tile.opentopomap.org/{z}/{x}/{y}.png',
+            attribution: '&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors, <a href="http://viewfinderpanoramas.org">SRTM</a> | Map style: &copy; <a href="https://opentopomap.org">OpenTopoMap</a>',
+            options: { maxZoom: 17 }
+        },
+        'cyclosm': {
+            url: 'https://{s}.tile-cyclosm.openstreetmap.fr/cyclosm/{z}/{x}/{y}.png',
+            attribution: '&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors, Map style: &copy; <a href="https://www.cyclosm.org">CyclOSM</a>',
+            options: { maxZoom: 20 }
+        },
+        'esri_world': {
+            url: 'https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}',
+            attribution: '&copy; <a href="https://www.esri.com/">Esri</a>, Maxar, Earthstar Geographics, and the GIS User Community',
+            options: { maxZoom: 19 }
+        },
+        'wikimedia': {
+            url: 'https://maps.wikimedia.org/osm-intl/{z}/{x}/{y}.png',
+            attribution: '&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors, <a href="https://wikimediafoundation.org/wiki/Maps_Terms_of_Use">Wikimedia maps</a>',
+            options: { maxZoom: 18 }
+        },
+        'toner_lite': {
+            url: 'https://tiles.stadiamaps.com/tiles/stamen_toner_lite/{z}/{x}/{y}{r}.png{{ api_key_param }}',
+            attribution: '&copy; <a href="https://stadiamaps.com/" target="_blank">Stadia Maps</a> &copy; <a href="https://stamen.com/" target="_blank">Stamen Design</a> &copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors',
+            options: { maxZoom: 20 }
+        },
+        'voyager_nolabels': {
+            url: 'https://{s}.basemaps.cartocdn.com/rastertiles/voyager_nolabels/{z}/{x}/{y}{r}.png',
+            attribution: '&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors &copy; <a href="https://carto.com/attributions">CARTO</a>',
+            options: { subdomains: 'abcd', maxZoom: 19 }
+        },
+        'positron_nolabels': {
+            url: 'https://{s}.basemaps.cartocdn.com/light_nolabels/{z}/{x}/{y}{r}.png',
+            attribution: '&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors &copy; <a href="https://carto.com/attributions">CARTO</a>',
+            options: { subdomains: 'abcd', maxZoom: 19 }
+        },
+        'dark_nolabels': {
+            url: 'https://{s}.basemaps.cartocdn.com/dark_nolabels/{z}/{x}/{y}{r}.png',
+            attribution: '&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors &copy; <a href="https://carto.com/attributions">CARTO</a>',
+            options: { subdomains: 'abcd', maxZoom: 19 }
+        },
+        'osm_de': {
+            url: 'https://{s}.tile.openstreetmap.de/{z}/{x}/{y}.png',
+            attribution: '&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors',
+            options: { maxZoom: 18 }
+        },
+        'toner_background': {
+            url: 'https://tiles.stadiamaps.com/tiles/stamen_toner_background/{z}/{x}/{y}{r}.png{{ api_key_param }}',
+            attribution: '&copy; <a href="https://stadiamaps.com/" target="_blank">Stadia Maps</a> &copy; <a href="https://stamen.com/" target="_blank">Stamen Design</a> &copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors',
+            options: { maxZoom: 20 }
+        },
+        'toner_lines': {
+            url: 'https://tiles.stadiamaps.com/tiles/stamen_toner_lines/{z}/{x}/{y}{r}.png{{ api_key_param }}',
+            attribution: '&copy; <a href="https://stadiamaps.com/" target="_blank">Stadia Maps</a> &copy; <a href="https://stamen.com/" target="_blank">Stamen Design</a> &copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors',
+            options: { maxZoom: 20 }
+        },
+        'esri_world_street': {
+            url: 'https://server.arcgisonline.com/ArcGIS/rest/services/World_Street_Map/MapServer/tile/{z}/{y}/{x}',
+            attribution: '&copy; <a href="https://www.esri.com/">Esri</a>',
+            options: { maxZoom: 19 }
+        },
+        'esri_world_topo': {
+            url: 'https://server.arcgisonline.com/ArcGIS/rest/services/World_Topo_Map/MapServer/tile/{z}/{y}/{x}',
+            attribution: '&copy; <a href="https://www.esri.com/">Esri</a>',
+            options: { maxZoom: 19 }
+        },
+        'esri_natgeo': {
+            url: 'https://server.arcgisonline.com/ArcGIS/rest/services/NatGeo_World_Map/MapServer/tile/{z}/{y}/{x}',
+            attribution: '&copy; <a href="https://www.esri.com/">Esri</a>, National Geographic',
+            options: { maxZoom: 16 }
+        }
+        // Additional providers (require API keys):
+        // Mapbox: https://api.mapbox.com/styles/v1/{id}/tiles/{z}/{x}/{y}?access_token={accessToken}
+        // Thunderforest: https://{s}.tile.thunderforest.com/{style}/{z}/{x}/{y}.png?apikey={apikey}
+        // Maptiler: https://api.maptiler.com/maps/{style}/256/{z}/{x}/{y}.png?key={key}
+    };
+    
+    // Start with configured default style
+    let currentLayer = '{{ default_style }}';
+    let activeLayer = L.tileLayer(tileLayers[currentLayer].url, {
+        attribution: tileLayers[currentLayer].attribution,
+        ...tileLayers[currentLayer].options
+    }).addTo(map);{% if include_style_switcher %}
+    
+    // Map style switcher function (preview mode only)
+    window.switchStyle = function(styleName) {
+        if (tileLayers[styleName]) {
+            map.removeLayer(activeLayer);
+            currentLayer = styleName;
+            activeLayer = L.tileLayer(tileLayers[currentLayer].url, {
+                attribution: tileLayers[currentLayer].attribution,
+                ...tileLayers[currentLayer].options
+            }).addTo(map);
+            
+            // Update active button
+            document.querySelectorAll('.style-btn').forEach(btn => {
+                btn.classList.remove('active');
+            });
+            document.querySelector(`[data-style="${styleName}"]`).classList.add('active');
+        }
+    };
+    
+    // Pin style switcher function (preview mode only)
+    window.switchPinStyle = function(styleName) {
+        if (pinStyles[styleName]) {
+            currentPinStyle = styleName;
+            
+            // Recreate markers with the new style
+            renderMarkers();
+            
+            // Update active button
+            document.querySelectorAll('.pin-btn').forEach(btn => {
+                btn.classList.remove('active');
+            });
+            document.querySelector(`[data-pin="${styleName}"]`).classList.add('active');
+            
+            // Update offscreen indicators
+            setTimeout(updateOffscreenIndicators, 100);
+        }
+    };
+    
+    // Panel toggle function (preview mode only)
+    window.togglePanel = function() {
+        const panel = document.getElementById('stylePanel');
+        panel.classList.toggle('collapsed');
+    };{% endif %}
+    
+    // Marker data (parsed from the JSON block, which is faster than a JS literal)
+    const markersData = JSON.parse(document.getElementById('marker-data').textContent);
+    
+    // Define pin styles
+    const pinStyles = {
+        'default': {
+            name: 'Default Blue',
+            createMarker: (lat, lng) => L.marker([lat, lng])
+        },
+        'burgundy_circle': {
+            name: 'Burgundy Circles',
+            createMarker: (lat, lng) => L.circleMarker([lat, lng], {
+                radius: 8,
+                fillColor: '#8B2635',
+                color: '#fff',
+                weight: 2,
+                opacity: 1,
+                fillOpacity: 0.8
+            })
+        },
+        'black_circle': {
+            name: 'Black Circles',
+            createMarker: (lat, lng) => L.circleMarker([lat, lng], {
+                radius: 8,
+                fillColor: '#2c3e50',
+                color: '#fff',
+                weight: 2,
+                opacity: 1,
+                fillOpacity: 0.9
+            })
+        },
+        'small_burgundy_pin': {
+            name: 'Small Burgundy Pin',
+            createMarker: (lat, lng) => {
+                const icon = L.divIcon({
+                    className: 'custom-pin burgundy-pin',
+                    html: '<div class="pin-content"></div>',
+                    iconSize: [20, 32],
+                    iconAnchor: [10, 32],
+                    popupAnchor: [0, -32]
+                });
+                return L.marker([lat, lng], { icon: icon });
+            }
+        },
+        'small_orange_pin': {
+            name: 'Small Orange Pin',
+            createMarker: (lat, lng) => {
+                const icon = L.divIcon({
+                    className: 'custom-pin orange-pin',
+                    html: '<div class="pin-content"></div>',
+                    iconSize: [20, 32],
+                    iconAnchor: [10, 32],
+                    popupAnchor: [0, -32]
+                });
+                return L.marker([lat, lng], { icon: icon });
+            }
+        },
+        'pushpin_emoji': {
+            name: 'Pushpin Emoji',
+            createMarker: (lat, lng) => {
+                const icon = L.divIcon({
+                    className: 'emoji-icon-marker',
+                    html: '<div class="emoji-icon">📌</div>',
+                    iconSize: [30, 30],
+                    iconAnchor: [15, 15],
+                    popupAnchor: [0, -15]
+                });
+                return L.marker([lat, lng], { icon: icon });
+            }
+        }
+    };
+    
+    // Current pin style
+    let currentPinStyle = '{{ default_pin_style }}';
+    
+    // Store marker data for recreation
+    let markerDataStore = [];
+    let markerLayer = L.layerGroup().addTo(map);
+    
+    // Create a marker with the current pin style; popups are prerendered at
+    // build time and only bound when the marker is first clicked
+    function createStyledMarker(stored) {
+        const marker = pinStyles[currentPinStyle].createMarker(stored.lat, stored.lng);
+        marker.once('click', () => marker.bindPopup(stored.popup).openPopup());
+        return marker;
+    }
+    
+    // Build every marker off-map and swap the whole set in as one layer
+    // group, so a restyle is one remove/add. Leaflet still adds each marker
+    // on its own; circle pins share the canvas renderer (preferCanvas),
+    // which coalesces their redraws into one frame
+    function renderMarkers() {
+        map.removeLayer(markerLayer);
+        markerLayer = L.layerGroup(markerDataStore.map(createStyledMarker)).addTo(map);
+    }
+    
+    // Function to create all markers with current style; pins sharing a
+    // location were already fanned out at build time
+    function createMarkers() {
+        markerDataStore = markersData;
+        renderMarkers();
+        return markersData.map(m => [m.lat, m.lng]);
+    }
+    
+    // Initial marker creation
+    const bounds = createMarkers();{% if center %}
+    
+    // Start at the mean marker position (computed at build time) at
+    // continent-level zoom; markers outside this view are counted by
+    // the off-screen indicators
+    map.setView([{{ center[0] }}, {{ center[1] }}], 3);{% endif %}
+    
+    // Create offscreen marker indicators in a single DOM insertion
+    const directions = ['north', 'south', 'east', 'west', 'northeast', 'northwest', 'southeast', 'southwest'];
+    document.getElementById('map').insertAdjacentHTML('beforeend', directions.map(dir =>
+        `<div class="offscreen-indicator ${dir}" id="indicator-${dir}"></div>`
+    ).join(''));
+    const indicators = directions.map(dir => document.getElementById(`indicator-${dir}`));
+    
+    // Map which viewport edges a marker is past (bits: north, south, east,
+    // west) to its index in `directions`; corners win over single edges
+    const INSIDE = 255;
+    const OCTANT_SLOTS = new Uint8Array([
+        INSIDE, 3, 2, 2,  // -, W, E, E+W
+        1, 7, 6, 6,       // S, SW, SE, SE
+        0, 5, 4, 4,       // N, NW, NE, NE
+        0, 5, 4, 4        // N+S resolves like N
+    ]);
+    
+    // Marker positions in pixel space for offscreen tracking, as packed
+    // arrays; reprojected whenever the zoom level changes
+    const markerXs = new Float64Array(bounds.length);
+    const markerYs = new Float64Array(bounds.length);
+    let projectedZoom = null;
+    
+    function projectMarkers(zoom) {
+        bounds.forEach((pos, i) => {
+            const point = map.project(pos, zoom);
+            markerXs[i] = point.x;
+            markerYs[i] = point.y;
+        });
+        projectedZoom = zoom;
+    }
+    
+    // Counts currently shown; every indicator starts hidden
+    const shownCounts = new Uint32Array(directions.length);
+    
+    // Function to update offscreen indicators
+    function updateOffscreenIndicators() {
+        const zoom = map.getZoom();
+        if (zoom !== projectedZoom) projectMarkers(zoom);
+        
+        // Read the viewport edges once rather than per marker; pixel y
+        // grows southward
+        const pixelBounds = map.getPixelBounds();
+        const top = pixelBounds.min.y;
+        const bottom = pixelBounds.max.y;
+        const left = pixelBounds.min.x;
+        const right = pixelBounds.max.x;
+        const counts = new Uint32Array(directions.length);
+        
+        for (let i = 0; i < markerXs.length; i++) {
+            const x = markerXs[i];
+            const y = markerYs[i];
+            const slot = OCTANT_SLOTS[(y < top) << 3 | (y > bottom) << 2 | (x > right) << 1 | (x < left)];
+            if (slot !== INSIDE) counts[slot]++;
+        }
+        
+        // Update indicator visibility and text, touching only changed ones
+        indicators.forEach((indicator, i) => {
+            const count = counts[i];
+            const shown = shownCounts[i];
+            if (count === shown) return;
+            shownCounts[i] = count;
+            // Hidden indicators keep their stale text; only flip the class
+            // when visibility actually changes
+            if (count > 0) indicator.textContent = count;
+            if ((count > 0) !== (shown > 0)) indicator.classList.toggle('visible', count > 0);
+        });
+    }
+    
+    // Update indicators while the map moves, at most once per frame
+    let indicatorFrame = 0;
+    function scheduleIndicatorUpdate() {
+        if (indicatorFrame) return;
+        indicatorFrame = requestAnimationFrame(() => {
+            indicatorFrame = 0;
+            updateOffscreenIndicators();
+        });
+    }
+    map.on('move', scheduleIndicatorUpdate);
+    
+    // Initial update after a delay (to let map settle)
+    setTimeout(updateOffscreenIndicators, 200);
+    